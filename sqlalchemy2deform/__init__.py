@@ -3,9 +3,16 @@
 
 from __future__ import unicode_literals  # unicode by default
 
+import hashlib
+import os
+import pickle
+import tempfile
 from collections import OrderedDict
 
+from sqlalchemy import __version__ as sa_version
 from sqlalchemy import types as sa_types
+from sqlalchemy import MetaData
+from sqlalchemy import Table
 from sqlalchemy import Column as SAColumn
 from sqlalchemy import ForeignKey as SAForeignKey
 from sqlalchemy.orm import class_mapper
@@ -16,8 +23,8 @@ import deform
 # TODO: * Map the sqlalchemy types to deform widgets
 #       * Work with relationships
 
-__all__ = ['Column', 'get_required_columns', 'get_autoincrement_columns',
-    'make_schema', 'make_form']
+__all__ = ['Column', 'ReflectionCache', 'get_required_columns',
+    'get_autoincrement_columns', 'make_schema', 'make_form']
 
 # Map sqlalchemy types to colander types.
 _TYPES = {
@@ -43,7 +50,8 @@ _WIDGETS = {
     sa_types.Boolean: deform.widget.CheckboxWidget,
     sa_types.Date: deform.widget.DateInputWidget,
     sa_types.DateTime: deform.widget.DateTimeInputWidget,
-    sa_types.Enum: deform.widget.SelectWidget,
+    # Enums listing their values get a SelectWidget with those choices.
+    sa_types.Enum: deform.widget.TextInputWidget,
     sa_types.Float: deform.widget.TextInputWidget,
     sa_types.Integer: deform.widget.TextInputWidget,
     sa_types.Numeric: deform.widget.TextInputWidget,
@@ -55,6 +63,20 @@ _WIDGETS = {
     sa_types.UnicodeText: deform.widget.TextAreaWidget,
 }
 
+# Colander type and deform widget used for sqlalchemy types without a
+# mapping (e.g. reflected BLOB, JSON or NullType columns).
+_DEFAULT_TYPE = colander.String
+_DEFAULT_WIDGET = deform.widget.TextInputWidget
+
+# Pickle protocol used by ReflectionCache.
+_PICKLE_PROTOCOL = 2
+
+# Colander type, select widget choices and validator for each set of enum
+# values, built once and shared between all the columns using them. Enum
+# types are expected to be created at import time (with the models), so
+# this cache doesn't grow while serving requests.
+_ENUM_CHOICES = {}
+
 
 class Column(SAColumn):
     """ Extends 'sqlalchemy.Column'. """
@@ -79,12 +101,18 @@ class Column(SAColumn):
         if not 'missing' in co_kw:
             co_kw['missing'] = colander.null if self.nullable else \
                     colander.required
+        co_type = _get_co_type_by_sa_type(sa_type)()
+        enum_choices = _get_enum_choices(self.type)
+        if enum_choices:
+            co_type, choices, validator = enum_choices
+            co_kw.setdefault('validator', validator)
+            co_kw.setdefault('widget', deform.widget.SelectWidget(
+                    values=choices))
         if not 'widget' in co_kw:
             co_kw['widget'] = deform.widget.HiddenWidget() if \
                     self.autoincrement and self.primary_key else \
                     _get_widget_by_sa_type(sa_type)()
-        co_type = _get_co_type_by_sa_type(sa_type)
-        self.schema = colander.SchemaNode(co_type(), **co_kw)
+        self.schema = colander.SchemaNode(co_type, **co_kw)
         self.widget = co_kw['widget']
         self.__co_kw = co_kw
 
@@ -99,6 +127,42 @@ class ForeignKey(SAForeignKey):
     pass
 
 
+class EnumString(colander.String):
+    """ Extends 'colander.String' to map python 'enum.Enum' members to and
+    from the names stored by a sqlalchemy Enum. """
+
+    def __init__(self, members, encoding=None):
+        super(EnumString, self).__init__(encoding)
+        # 'members' maps each stored name to its enum member.
+        self.members = members
+        self.names = {}
+        for name, member in members.items():
+            self.names.setdefault(member, name)
+
+    def serialize(self, node, appstruct):
+        appstruct = self.names.get(appstruct, appstruct)
+        return super(EnumString, self).serialize(node, appstruct)
+
+    def deserialize(self, node, cstruct):
+        value = super(EnumString, self).deserialize(node, cstruct)
+        # Unknown names are kept as strings and rejected by the validator.
+        return self.members.get(value, value)
+
+
+class _EnumChoices(frozenset):
+    """ frozenset of the valid values that iterates over the valid 'names'
+    in order, so 'colander.OneOf' lists them in order in its error message
+    while still testing the membership using a set. """
+
+    def __new__(cls, choices, names):
+        self = super(_EnumChoices, cls).__new__(cls, choices)
+        self.names = names
+        return self
+
+    def __iter__(self):
+        return iter(self.names)
+
+
 class Form(deform.Form):
     """ Extends 'deform.Form' to allow autofill using sqlalchemy object. """
     def __init__(self, schema, object_=None, *args, **kw):
@@ -117,18 +181,127 @@ class Form(deform.Form):
         return super(Form, self).render(appstruct, readonly, *args, **kw)
 
 
+class ReflectionCache(object):
+    """ Stores reflected sqlalchemy metadata in local files keyed by the
+    schema 'version', so each database is only reflected once per version.
+    The 'path' directory is created if it doesn't exist. """
+
+    def __init__(self, path, version):
+        self.path = path
+        self.version = version
+        self._metadata = {}
+
+    def filename(self, bind):
+        """ Returns the cache file for 'bind'. The pickled metadata depends
+        on the database and on the sqlalchemy version, so both are part of
+        the key. """
+        # 'bind' can be an Engine or a Connection.
+        url = getattr(bind, 'engine', bind).url
+        url = hashlib.sha1(str(url).encode('utf-8')).hexdigest()
+        return os.path.join(self.path, 'metadata-%s-%s-%s.pickle' % (
+                self.version, sa_version, url))
+
+    def metadata(self, bind):
+        """ Returns the cached MetaData, reflecting it from 'bind' and
+        storing it on disk if this version was not cached yet or the cache
+        file can't be read. """
+        filename = self.filename(bind)
+        if filename in self._metadata:
+            return self._metadata[filename]
+        metadata = None
+        if os.path.exists(filename):
+            try:
+                with open(filename, 'rb') as file_:
+                    metadata = pickle.load(file_)
+            except Exception:
+                # A corrupt cache is overwritten below.
+                metadata = None
+        if metadata is None:
+            metadata = MetaData()
+            metadata.reflect(bind=bind)
+            self._write(filename, metadata)
+        self._metadata[filename] = metadata
+        return metadata
+
+    def _write(self, filename, metadata):
+        if not os.path.isdir(self.path):
+            os.makedirs(self.path)
+        # Write to a temporary file first so concurrent workers never read
+        # a partially written cache.
+        fd, tmpname = tempfile.mkstemp(dir=self.path)
+        try:
+            with os.fdopen(fd, 'wb') as file_:
+                # A fixed protocol keeps the cache readable by every python.
+                pickle.dump(metadata, file_, _PICKLE_PROTOCOL)
+            # mkstemp creates the file readable only by its owner, but the
+            # cache is shared by workers that may run as other users.
+            umask = os.umask(0)
+            os.umask(umask)
+            os.chmod(tmpname, 0o666 & ~umask)
+            os.rename(tmpname, filename)
+        except:
+            os.unlink(tmpname)
+            raise
+
+    def table(self, name, bind):
+        """ Returns the reflected Table called 'name'. """
+        return self.metadata(bind).tables[name]
+
+
 def _get_co_type_by_sa_type(type_):
     """ Returns the colander type that correspondents to the sqlalchemy type
     'type_'. """
-    return _TYPES.get(type_) or _TYPES.get(type_.__bases__[0])
+    # Walk the whole mro since dialect types (e.g. reflected ones) don't
+    # always have the generic type as their first base.
+    for cls in type_.__mro__:
+        if cls in _TYPES:
+            return _TYPES[cls]
+    return _DEFAULT_TYPE
 
 
 def _get_widget_by_sa_type(type_):
     """ Returns the deform widget that correspondents to the sqlalchemy type
     'type_'. """
     # Don't cover because widgets can be changed any time.
-    return _WIDGETS.get(type_) or \
-            _WIDGETS.get(type_.__bases__[0])  # pragma: no cover
+    for cls in type_.__mro__:  # pragma: no cover
+        if cls in _WIDGETS:
+            return _WIDGETS[cls]
+    return _DEFAULT_WIDGET  # pragma: no cover
+
+
+def _get_enum_choices(sa_type):
+    """ Returns the colander type, the select widget choices and the colander
+    validator for the sqlalchemy Enum instance 'sa_type', or None if it isn't
+    an Enum listing its values. """
+    # 'enums' holds the values stored in the database, also for postgresql
+    # native enums and Enums created from python 'enum.Enum' classes.
+    enums = tuple(getattr(sa_type, 'enums', None) or ())
+    if not isinstance(sa_type, sa_types.Enum) or not enums:
+        return None
+    enum_class = getattr(sa_type, 'enum_class', None)
+    key = (enum_class, enums)
+    if not key in _ENUM_CHOICES:
+        choices = tuple((value, value) for value in enums)
+        if enum_class is None:
+            co_type = colander.String()
+            validator = colander.OneOf(_EnumChoices(enums, enums))
+        else:
+            # sqlalchemy lists the stored values in the same order as the
+            # members, aliases included.
+            members = OrderedDict(zip(enums,
+                    enum_class.__members__.values()))
+            co_type = EnumString(members)
+            validator = colander.OneOf(_EnumChoices(members.values(), enums))
+        _ENUM_CHOICES[key] = (co_type, choices, validator)
+    return _ENUM_CHOICES[key]
+
+
+def _get_sa_columns(model):
+    """ Returns the columns from 'model', that can be a mapped class or a
+    sqlalchemy Table. """
+    if isinstance(model, Table):
+        return model.columns
+    return class_mapper(model).columns
 
 
 def _get_columns_co_types(mapper):
@@ -146,8 +319,7 @@ def is_required(column):
 
 def get_required_columns(model):
     """ Returns a list containing the names of required columns. """
-    mapper = class_mapper(model)
-    columns = mapper.columns
+    columns = _get_sa_columns(model)
     return (column.name for column in columns if is_required(column))
 
 
@@ -158,17 +330,16 @@ def is_autoincrement(column):
 def get_autoincrement_columns(model):
     """ Returns a list containing the names of columns with autoincrement
     property. """
-    mapper = class_mapper(model)
-    columns = mapper.columns
+    columns = _get_sa_columns(model)
     return (column.name for column in columns if is_autoincrement(column))
 
 
 def make_schema(model, columns=None, widgets=None):
-    """ Returns a colander.Schema created from the sqlalchemy 'model'. """
+    """ Returns a colander.Schema created from the sqlalchemy 'model', that
+    can be a mapped class or a Table. """
     if widgets is None:
         widgets = {}
-    mapper = class_mapper(model)
-    sa_columns = sa_columns_ = mapper.columns
+    sa_columns = sa_columns_ = _get_sa_columns(model)
     if columns is not None:
         sa_columns = (sa_columns_.get(column) for column in columns)
     schemanodes = {}
@@ -190,8 +361,15 @@ def make_schema(model, columns=None, widgets=None):
                     else colander.null
             widget = deform.widget.HiddenWidget() if \
                     is_autoincrement(sa_column) else widgets.get(column)
-            schemanodes[column] = colander.SchemaNode(co_type(),
-                    description=column, missing=missing, widget=widget)
+            co_type, validator = co_type(), None
+            enum_choices = _get_enum_choices(sa_column.type)
+            if enum_choices:
+                co_type, choices, validator = enum_choices
+                if widget is None:
+                    widget = deform.widget.SelectWidget(values=choices)
+            schemanodes[column] = colander.SchemaNode(co_type,
+                    description=column, missing=missing, widget=widget,
+                    validator=validator)
     schema = type(b'Schema', (colander.Schema, ), schemanodes)
     return schema()
 
@@ -201,7 +379,7 @@ def make_form(model, *args, **kw):
     'model'. """
     object_ = None
     # If we got an instance get the class
-    if not isinstance(model, type):
+    if not isinstance(model, (type, Table)):
         object_ = model
         model = model.__class__
     schema = make_schema(model, kw.get('column'), kw.get('widgets'))
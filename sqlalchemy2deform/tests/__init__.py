@@ -35,6 +35,17 @@ def schema_factory(nodes=None):
     return type(b'Schema', (Schema, ), attributes)
 
 
+def assert_schema(testcase, schema, myschema):
+    """ Assert that the nodes from 'schema' match the ones from 'myschema'. """
+    myschema_nodes = myschema.children
+    for i, node in enumerate(schema):
+        testcase.assertEqual(node.name, myschema_nodes[i].name)
+        testcase.assertEqual(node.typ.__class__,
+                myschema_nodes[i].typ.__class__)
+        testcase.assertEqual(node.required, myschema_nodes[i].required)
+    testcase.assertEqual(schema.typ.__class__, myschema.typ.__class__)
+
+
 class TestConversion(unittest.TestCase):
     def _makeModel(self):
         """ Make a sqlalchemy model. """
@@ -272,6 +283,256 @@ class TestModel(unittest.TestCase):
         self.assertEqual(schema.typ.__class__, myschema.typ.__class__)
 
 
+class TestTable(unittest.TestCase):
+    def setUp(self):
+        import tempfile
+        self.tmpdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        import shutil
+        shutil.rmtree(self.tmpdir)
+
+    def _makeTable(self, metadata):
+        """ Make a sqlalchemy table. """
+        from sqlalchemy import Table
+        from sqlalchemy import Column
+        from sqlalchemy.types import Unicode
+        from sqlalchemy.types import Integer
+        from sqlalchemy.types import Float
+        from sqlalchemy.types import DateTime
+
+        return Table('model', metadata,
+                Column('id_column', Integer, primary_key=True,
+                    autoincrement=True),
+                Column('unicode_column', Unicode, nullable=False,
+                    default='Default Text'),
+                Column('integer_column', Integer, default=10),
+                Column('float_column', Float),
+                Column('datetime_column', DateTime))
+
+    def _makeEngine(self, name='test.db'):
+        """ Make a sqlite engine with the table created. """
+        import os
+        from sqlalchemy import create_engine
+        from sqlalchemy import MetaData
+
+        path = os.path.join(self.tmpdir, name)
+        engine = create_engine('sqlite:///%s' % path)
+        metadata = MetaData()
+        self._makeTable(metadata)
+        metadata.create_all(engine)
+        return engine
+
+    def _makeSchema(self, nodes=None):
+        """ Make a colander schema. """
+        return schema_factory(nodes)
+
+    def test_get_required_columns(self):
+        from sqlalchemy import MetaData
+        import sqlalchemy2deform
+
+        T = self._makeTable(MetaData())
+        sa_required = [i for i in sqlalchemy2deform.get_required_columns(T)]
+        self.assertEqual(sa_required, ['id_column', 'unicode_column'])
+
+    def test_get_autoincrement_columns(self):
+        from sqlalchemy import MetaData
+        import sqlalchemy2deform
+
+        T = self._makeTable(MetaData())
+        sa_types = [i for i in sqlalchemy2deform.get_autoincrement_columns(T)]
+        self.assertEqual(sa_types, ['id_column'])
+
+    def test_make_schema(self):
+        from sqlalchemy import MetaData
+        import sqlalchemy2deform
+
+        T = self._makeTable(MetaData())
+        assert_schema(self, sqlalchemy2deform.make_schema(T),
+                self._makeSchema()())
+
+    def test_make_schema_reflected(self):
+        from sqlalchemy import MetaData
+        from sqlalchemy import Table
+        import sqlalchemy2deform
+
+        engine = self._makeEngine()
+        T = Table('model', MetaData(), autoload=True, autoload_with=engine)
+        assert_schema(self, sqlalchemy2deform.make_schema(T),
+                self._makeSchema()())
+
+    def test_make_schema_reflected_unmapped_types(self):
+        import colander
+        import deform
+        from sqlalchemy import MetaData
+        from sqlalchemy import Table
+        import sqlalchemy2deform
+
+        engine = self._makeEngine()
+        engine.execute('CREATE TABLE other (id INTEGER PRIMARY KEY, '
+                'data BLOB, untyped)')
+        T = Table('other', MetaData(), autoload=True, autoload_with=engine)
+        schema = sqlalchemy2deform.make_schema(T)
+
+        self.assertEqual([node.name for node in schema],
+                ['id', 'data', 'untyped'])
+        for name in ['data', 'untyped']:
+            self.assertEqual(schema[name].typ.__class__, colander.String)
+        form = deform.Form(schema)
+        form.render()
+
+    def test_make_form(self):
+        import deform
+        from sqlalchemy import MetaData
+        import sqlalchemy2deform
+
+        T = self._makeTable(MetaData())
+        S = self._makeSchema()
+
+        myform = deform.Form(S(), buttons=('submit',))
+        form = sqlalchemy2deform.make_form(T)
+
+        self.assertEqual(form.render(), myform.render())
+
+    def test_reflection_cache(self):
+        import os
+        from sqlalchemy import create_engine
+        import sqlalchemy2deform
+        from sqlalchemy2deform import ReflectionCache
+
+        engine = self._makeEngine()
+        cache = ReflectionCache(self.tmpdir, '1')
+        T = cache.table('model', engine)
+        self.assertTrue(os.path.exists(cache.filename(engine)))
+        self.assertEqual([c.name for c in T.columns],
+                ['id_column', 'unicode_column', 'integer_column',
+                 'float_column', 'datetime_column'])
+
+        # A new cache for the same version and database must not hit the
+        # database.
+        engine.execute('DROP TABLE model')
+        T = ReflectionCache(self.tmpdir, '1').table('model', engine)
+        assert_schema(self, sqlalchemy2deform.make_schema(T),
+                self._makeSchema()())
+
+        # A new version reflects again.
+        cache = ReflectionCache(self.tmpdir, '2')
+        self.assertRaises(KeyError, cache.table, 'model', engine)
+
+        # Another database with the same version doesn't share the cache.
+        empty = create_engine('sqlite://')
+        cache = ReflectionCache(self.tmpdir, '1')
+        self.assertRaises(KeyError, cache.table, 'model', empty)
+
+    def test_reflection_cache_dialect_types(self):
+        import colander
+        import pickle
+        from sqlalchemy import Column
+        from sqlalchemy import MetaData
+        from sqlalchemy import Table
+        from sqlalchemy.dialects import mysql
+        from sqlalchemy.dialects import sqlite
+        import sqlalchemy2deform
+        from sqlalchemy2deform import ReflectionCache
+
+        # Dialect types (as returned by e.g. mysql reflection) don't always
+        # have the generic type as their first base, so they are only found
+        # walking the mro.
+        engine = self._makeEngine()
+        metadata = MetaData()
+        Table('dialect', metadata,
+                Column('id', mysql.INTEGER, primary_key=True),
+                Column('created', sqlite.DATETIME))
+        cache = ReflectionCache(self.tmpdir, '1')
+        with open(cache.filename(engine), 'wb') as file_:
+            pickle.dump(metadata, file_)
+
+        T = ReflectionCache(self.tmpdir, '1').table('dialect', engine)
+        for column in T.columns:
+            sa_type = column.type.__class__
+            self.assertFalse(sa_type.__bases__[0] in sqlalchemy2deform._TYPES)
+        schema = sqlalchemy2deform.make_schema(T)
+        self.assertEqual(schema['id'].typ.__class__, colander.Integer)
+        self.assertEqual(schema['created'].typ.__class__, colander.DateTime)
+
+    def test_reflection_cache_creates_path(self):
+        import os
+        from sqlalchemy2deform import ReflectionCache
+
+        engine = self._makeEngine()
+        path = os.path.join(self.tmpdir, 'cache', 'dir')
+        ReflectionCache(path, '1').metadata(engine)
+        self.assertEqual(len(os.listdir(path)), 1)
+
+    def test_reflection_cache_write_failure(self):
+        import os
+        import pickle
+        import sqlalchemy2deform
+        from sqlalchemy2deform import ReflectionCache
+
+        class BrokenPickle(object):
+            PicklingError = pickle.PicklingError
+
+            def dump(self, *args, **kw):
+                raise pickle.PicklingError()
+
+            def load(self, *args, **kw):
+                return pickle.load(*args, **kw)
+
+        engine = self._makeEngine()
+        path = os.path.join(self.tmpdir, 'cache')
+        sqlalchemy2deform.pickle = BrokenPickle()
+        try:
+            self.assertRaises(pickle.PicklingError,
+                    ReflectionCache(path, '1').metadata, engine)
+        finally:
+            sqlalchemy2deform.pickle = pickle
+        self.assertEqual(os.listdir(path), [])
+
+    def test_reflection_cache_corrupt_file(self):
+        from sqlalchemy2deform import ReflectionCache
+
+        engine = self._makeEngine()
+        cache = ReflectionCache(self.tmpdir, '1')
+        with open(cache.filename(engine), 'wb') as file_:
+            file_.write(b'garbage')
+
+        T = cache.table('model', engine)
+        self.assertEqual(T.name, 'model')
+        # The corrupt file was overwritten with the reflected metadata.
+        T = ReflectionCache(self.tmpdir, '1').table('model', engine)
+        self.assertEqual(T.name, 'model')
+
+    def test_reflection_cache_connection(self):
+        from sqlalchemy2deform import ReflectionCache
+
+        engine = self._makeEngine()
+        cache = ReflectionCache(self.tmpdir, '1')
+        connection = engine.connect()
+        try:
+            self.assertEqual(cache.filename(connection),
+                    cache.filename(engine))
+            T = cache.table('model', connection)
+        finally:
+            connection.close()
+        self.assertEqual(T.name, 'model')
+
+    def test_reflection_cache_file_mode(self):
+        import os
+        import stat
+        from sqlalchemy2deform import ReflectionCache
+
+        engine = self._makeEngine()
+        cache = ReflectionCache(self.tmpdir, '1')
+        umask = os.umask(0o022)
+        try:
+            cache.metadata(engine)
+        finally:
+            os.umask(umask)
+        mode = stat.S_IMODE(os.stat(cache.filename(engine)).st_mode)
+        self.assertEqual(mode, 0o644)
+
+
 class TestColumn(unittest.TestCase):
     def _makeMe(self, type_, *args, **kw):
         from sqlalchemy2deform import Column
@@ -319,3 +580,141 @@ class TestColumn(unittest.TestCase):
 
         self.assertEqual(column.render(),
                 widget.serialize(field, 'Default Value'))
+
+
+class TestEnum(unittest.TestCase):
+    def _makeEnumClass(self):
+        """ Make a python enum class. """
+        try:
+            import enum
+        except ImportError:  # pragma: no cover
+            self.skipTest('enum (enum34 on python 2) is not installed')
+
+        class Mood(enum.Enum):
+            happy = 1
+            sad = 2
+
+        return Mood
+
+    def _makeModel(self, Mood=None):
+        """ Make a sqlalchemy model with enum columns. """
+        from sqlalchemy import Column
+        from sqlalchemy.types import Integer
+        from sqlalchemy.types import Enum
+        from sqlalchemy.dialects import postgresql
+        from sqlalchemy.ext.declarative import declarative_base
+        import sqlalchemy2deform
+        Base = declarative_base()
+
+        class Model(Base):
+            __tablename__ = 'model'
+
+            id_column = Column(Integer, primary_key=True, autoincrement=True)
+            enum_column = Column(Enum('a', 'b', 'c'))
+            another_enum_column = sqlalchemy2deform.Column(
+                    Enum('a', 'b', 'c'))
+            pg_enum_column = Column(postgresql.ENUM('a', 'b', 'c',
+                    name='letters'))
+            existing_enum_column = Column(postgresql.ENUM(name='existing',
+                    create_type=False))
+            if Mood is not None:
+                mood_column = Column(Enum(Mood))
+
+        return Model
+
+    def test__get_enum_choices(self):
+        from sqlalchemy.types import Enum
+        import sqlalchemy2deform
+
+        co_type, choices, validator = sqlalchemy2deform._get_enum_choices(
+                Enum('x', 'y'))
+        self.assertEqual(choices, (('x', 'x'), ('y', 'y')))
+        self.assertEqual(validator.choices, frozenset(['x', 'y']))
+        # Same values must share the precomputed choices and validator.
+        self.assertTrue(sqlalchemy2deform._get_enum_choices(
+                Enum('x', 'y'))[2] is validator)
+
+    def test__get_enum_choices_without_values(self):
+        from sqlalchemy.types import Enum
+        from sqlalchemy.types import Unicode
+        from sqlalchemy.dialects import postgresql
+        import sqlalchemy2deform
+
+        self.assertEqual(sqlalchemy2deform._get_enum_choices(Enum()), None)
+        self.assertEqual(sqlalchemy2deform._get_enum_choices(
+                postgresql.ENUM(name='existing', create_type=False)), None)
+        self.assertEqual(sqlalchemy2deform._get_enum_choices(Unicode()),
+                None)
+
+    def test_validator_message(self):
+        import colander
+        from sqlalchemy.types import Enum
+        import sqlalchemy2deform
+
+        validator = sqlalchemy2deform._get_enum_choices(
+                Enum('y', 'x', 'w'))[2]
+        node = colander.SchemaNode(colander.String())
+        try:
+            validator(node, 'z')
+        except colander.Invalid as e:
+            self.assertEqual(e.asdict(), {'': '"z" is not one of y, x, w'})
+        else:
+            self.fail('Invalid not raised')
+
+    def test_make_schema(self):
+        import colander
+        import deform
+        import sqlalchemy2deform
+
+        M = self._makeModel()
+        schema = sqlalchemy2deform.make_schema(M)
+
+        for name in ['enum_column', 'another_enum_column', 'pg_enum_column']:
+            node = schema[name]
+            self.assertTrue(isinstance(node.widget,
+                    deform.widget.SelectWidget))
+            self.assertEqual(node.widget.values,
+                    (('a', 'a'), ('b', 'b'), ('c', 'c')))
+            self.assertEqual(node.deserialize('b'), 'b')
+            self.assertRaises(colander.Invalid, node.deserialize, 'd')
+
+        self.assertTrue(schema['enum_column'].validator is
+                schema['another_enum_column'].validator)
+
+    def test_make_schema_without_values(self):
+        import sqlalchemy2deform
+
+        M = self._makeModel()
+        node = sqlalchemy2deform.make_schema(M)['existing_enum_column']
+        self.assertEqual(node.widget, None)
+        self.assertEqual(node.validator, None)
+        self.assertEqual(node.deserialize('anything'), 'anything')
+
+    def test_make_schema_enum_class(self):
+        import colander
+        import sqlalchemy2deform
+
+        Mood = self._makeEnumClass()
+        M = self._makeModel(Mood)
+        node = sqlalchemy2deform.make_schema(M)['mood_column']
+
+        self.assertEqual(node.widget.values,
+                (('happy', 'happy'), ('sad', 'sad')))
+        self.assertEqual(node.serialize(Mood.sad), 'sad')
+        self.assertEqual(node.deserialize('sad'), Mood.sad)
+        self.assertRaises(colander.Invalid, node.deserialize, 'angry')
+
+    def test_make_form_enum_class(self):
+        import re
+        import sqlalchemy2deform
+
+        Mood = self._makeEnumClass()
+        M = self._makeModel(Mood)
+        form = sqlalchemy2deform.make_form(M(mood_column=Mood.sad),
+                column=['mood_column'])
+
+        html = form.render()
+        selected = re.findall(r'<option[^>]*selected="selected"[^>]*>', html)
+        self.assertEqual(len(selected), 1)
+        self.assertTrue('value="sad"' in selected[0])
+        self.assertFalse('Mood.sad' in html)